@@ -0,0 +1,41 @@
+"""
+One-off migration: set user_email on results written before it was
+denormalized onto them, so /results?user_email= finds historical rows.
+
+Run once per database, before or right after deploying (safe to re-run):
+
+    python backfill_result_emails.py
+"""
+
+import asyncio
+
+from bson import ObjectId
+from pymongo import UpdateMany
+
+from database import db
+
+
+async def backfill_result_emails() -> int:
+    """Fill in missing result.user_email from user_id; returns the number of results updated"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    user_ids = await db["result"].distinct("user_id", {"user_email": None})
+    oids = [ObjectId(u) for u in user_ids if ObjectId.is_valid(u)]
+    if not oids:
+        return 0
+
+    # One bulk_write for the whole migration instead of a round trip per user
+    ops = [
+        UpdateMany({"user_id": str(u["_id"]), "user_email": None}, {"$set": {"user_email": u["email"]}})
+        async for u in db["user"].find({"_id": {"$in": oids}}, {"email": 1})
+    ]
+    if not ops:
+        return 0
+    result = await db["result"].bulk_write(ops, ordered=False)
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    updated = asyncio.run(backfill_result_emails())
+    print(f"Backfilled user_email on {updated} results")
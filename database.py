@@ -5,11 +5,13 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCursor
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Tuple, Union
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -22,28 +24,70 @@ database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # Pool sizes are per process: every server worker opens its own pool, so keep them
+    # small and size the total (workers x MONGO_MAX_POOL_SIZE) against the server's limit
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 20)),
+        minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+        waitQueueTimeoutMS=2500,
+        serverSelectionTimeoutMS=2000,
+        retryWrites=True,
+        appname="laboratory-api",
+    )
     db = _client[database_name]
 
+def _bson_datetime(value: datetime) -> datetime:
+    """Normalize a datetime to what MongoDB stores and returns: naive UTC, millisecond precision"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def _prepare_document(data: Union[BaseModel, dict], now: datetime) -> dict:
+    """Convert to a dict, add timestamps, and normalize datetimes so the returned
+    document matches what a later read of it would give back"""
+    data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+    for k, v in data_dict.items():
+        if isinstance(v, datetime):
+            data_dict[k] = _bson_datetime(v)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
+    return data_dict
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
+async def create_document(collection_name: str, data: Union[BaseModel, dict]) -> Tuple[ObjectId, dict]:
+    """Insert a single document with timestamp, returning (inserted id, stored document)"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
-    # Convert Pydantic model to dict if needed
-    if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
-    else:
-        data_dict = data.copy()
+    data_dict = _prepare_document(data, _bson_datetime(datetime.now(timezone.utc)))
+    result = await db[collection_name].insert_one(data_dict)
+    return result.inserted_id, data_dict
+
+async def create_documents(collection_name: str, items: List[Union[BaseModel, dict]]) -> Tuple[List[dict], List[dict]]:
+    """Insert many documents with timestamps in one unordered round trip.
+
+    Returns (stored documents, write errors). Each write error has the input
+    "index" and the server's "message"; those rows were not stored.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    now = _bson_datetime(datetime.now(timezone.utc))
+    docs = [_prepare_document(data, now) for data in items]
 
-    result = db[collection_name].insert_one(data_dict)
-    return str(result.inserted_id)
+    try:
+        await db[collection_name].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors") or []
+        if not write_errors:
+            raise
+        errors = [{"index": err["index"], "message": err.get("errmsg", "")} for err in write_errors]
+        failed = {err["index"] for err in errors}
+        return [doc for i, doc in enumerate(docs) if i not in failed], errors
+    return docs, []
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +96,11 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
+
+def find_documents(collection_name: str, filter_dict: dict = None, projection: dict = None) -> AsyncIOMotorCursor:
+    """Open a cursor over a collection for streaming, leaving batching to the driver"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    return db[collection_name].find(filter_dict or {}, projection)
@@ -1,15 +1,49 @@
 import os
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+import logging
+import secrets
+from contextlib import asynccontextmanager
+from typing import Annotated, List, Optional
+from fastapi import Body, FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from datetime import datetime
-from bson import ObjectId
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, EmailStr, Field
+import orjson
+from pymongo.errors import DuplicateKeyError, ServerSelectionTimeoutError
 
-from database import db, create_document, get_documents
+from database import db, create_document, create_documents, find_documents
 from schemas import User as UserSchema, Service as ServiceSchema, Payment as PaymentSchema, Result as ResultSchema
 
-app = FastAPI(title="Laboratory API", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+# (collection, key, options) created at startup
+INDEXES = [
+    # Unique indexes let inserts report conflicts without a pre-check query
+    ("user", "email", {"unique": True}),
+    ("service", "code", {"unique": True}),
+    # /results?user_email= filters on this field alone
+    ("result", "user_email", {}),
+]
+
+async def ensure_indexes():
+    # Failures are logged, not raised: an unreachable server or pre-existing
+    # duplicates must not stop the app from booting and reporting via /test
+    for collection, key, options in INDEXES:
+        try:
+            await db[collection].create_index(key, **options)
+        except ServerSelectionTimeoutError:
+            logger.exception("MongoDB unreachable; skipping index creation")
+            return
+        except Exception:
+            logger.exception("Could not create index on %s.%s", collection, key)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if db is not None:
+        await ensure_indexes()
+    yield
+
+app = FastAPI(title="Laboratory API", version="1.0.0", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,29 +53,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Utility to convert ObjectId
+# Utility to convert ObjectId (mutates doc in place; callers pass dicts they own)
 
 def to_str_id(doc: dict):
     if doc is None:
         return None
-    doc = dict(doc)
     if "_id" in doc:
         doc["id"] = str(doc.pop("_id"))
-    # datetime to iso
-    for k, v in list(doc.items()):
-        if isinstance(v, datetime):
-            doc[k] = v.isoformat()
+    # datetimes are serialized natively by orjson
     return doc
 
+def document_response(doc: dict) -> ORJSONResponse:
+    # Serialize with orjson directly, exactly like the list endpoints do
+    return ORJSONResponse(to_str_id(doc))
+
+def _row_json(doc: dict) -> bytes:
+    # cursor rows always carry _id and datetimes go straight to orjson,
+    # so the per-row conversion is a single assignment
+    doc["id"] = str(doc.pop("_id"))
+    return orjson.dumps(doc)
+
+async def _json_array(first: dict, cursor):
+    # Emit a JSON array one row at a time instead of materializing the result set
+    yield b"[" + _row_json(first)
+    async for doc in cursor:
+        yield b"," + _row_json(doc)
+    yield b"]"
+
+async def stream_documents(collection_name: str, filter_dict: dict = None, projection: dict = None):
+    # Open the cursor and fetch the first row before any headers are sent, so
+    # connection, query and projection errors still surface as error responses
+    cursor = find_documents(collection_name, filter_dict, projection)
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        return ORJSONResponse([])
+    return StreamingResponse(_json_array(first, cursor), media_type="application/json")
+
+# Timestamps added by create_document on top of each schema's own fields
+TIMESTAMP_FIELDS = ("created_at", "updated_at")
+
+def build_projection(schema: type, default_fields: List[str], fields: Optional[str]) -> dict:
+    """Summary projection plus any extra comma-separated fields the client asked for"""
+    extra = [f.strip() for f in fields.split(",") if f.strip()] if fields else []
+    unknown = set(extra) - set(schema.model_fields) - set(TIMESTAMP_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {k: 1 for k in ["_id", *default_fields, *extra]}
+
 # Auth models
+# Upper bound on password length so oversized bodies can't make hashing/caching expensive
+MAX_PASSWORD_LENGTH = 128
+
 class SignupRequest(BaseModel):
     name: str
     email: EmailStr
-    password: str
+    password: str = Field(..., max_length=MAX_PASSWORD_LENGTH)
 
 class LoginRequest(BaseModel):
     email: EmailStr
-    password: str
+    password: str = Field(..., max_length=MAX_PASSWORD_LENGTH)
 
 class AuthResponse(BaseModel):
     token: str
@@ -49,43 +120,86 @@ class AuthResponse(BaseModel):
     email: EmailStr
 
 # NOTE: For demo we store password hash and use a simple token (not prod). In real apps use JWT + proper hashing.
-from hashlib import sha256
+from hashlib import sha256, blake2b
+from cachetools import TTLCache
 
 def hash_password(p: str) -> str:
     return sha256(p.encode()).hexdigest()
 
+def make_token(email: str, user_id: str) -> str:
+    # Simple token: hash of email + user id (blake2b is faster than software SHA-256).
+    # Fed piecewise as bytes, same digest as hashing f"{email}:{user_id}"
+    h = blake2b(digest_size=16)
+    h.update(email.encode())
+    h.update(b":")
+    h.update(user_id.encode())
+    return h.hexdigest()
+
+# Login verification cache: (email, password hash) -> user doc, or None for a wrong password.
+# Wrong passwords against an existing user are cached so repeated bad logins don't hit the
+# database; unknown emails are not, since the user may sign up on another worker.
+_login_cache = TTLCache(maxsize=4096, ttl=60)
+_MISSING = object()
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Laboratory API running"}
 
 # Auth endpoints
 @app.post("/auth/signup", response_model=AuthResponse)
-def signup(payload: SignupRequest):
-    # check exists
-    exists = db["user"].find_one({"email": payload.email}) if db else None
-    if exists:
-        raise HTTPException(status_code=400, detail="Email already registered")
+async def signup(payload: SignupRequest):
     user = UserSchema(name=payload.name, email=payload.email, password_hash=hash_password(payload.password))
-    user_id = create_document("user", user)
-    # Simple token: hash of email + created id
-    token = sha256(f"{payload.email}:{user_id}".encode()).hexdigest()
+    try:
+        user_id, _ = await create_document("user", user)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    token = make_token(payload.email, str(user_id))
     return AuthResponse(token=token, name=payload.name, email=payload.email)
 
 @app.post("/auth/login", response_model=AuthResponse)
-def login(payload: LoginRequest):
-    user = db["user"].find_one({"email": payload.email}) if db else None
+async def login(payload: LoginRequest):
+    key = (payload.email, hash_password(payload.password))
+    user = _login_cache.get(key, _MISSING)
+    if user is _MISSING:
+        user = await db["user"].find_one({"email": payload.email}) if db is not None else None
+        if user:
+            if user.get("password_hash") != key[1]:
+                user = None
+            _login_cache[key] = user
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    if user.get("password_hash") != hash_password(payload.password):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = sha256(f"{user['email']}:{str(user['_id'])}".encode()).hexdigest()
-    return AuthResponse(token=token, name=user["name"], email=user["email"]) 
+    token = make_token(user["email"], str(user["_id"]))
+    return AuthResponse(token=token, name=user["name"], email=user["email"])
+
+# Shared user lookup for endpoints that reference a user by email.
+# Only hits are cached, so a new signup is visible immediately (entries are shared, treat as read-only)
+_user_cache = TTLCache(maxsize=4096, ttl=60)
+
+async def get_user_by_email(email: str) -> Optional[dict]:
+    user = _user_cache.get(email)
+    if user is None:
+        user = await db["user"].find_one({"email": email}, {"_id": 1, "email": 1, "name": 1})
+        if user is not None:
+            _user_cache[email] = user
+    return user
 
 # Services endpoints
+# The catalog changes rarely; cache lookups by code (entries are shared, treat as read-only)
+_service_cache = TTLCache(maxsize=512, ttl=60)
+
+async def get_service_by_code(code: str) -> Optional[dict]:
+    service = _service_cache.get(code)
+    if service is None:
+        service = await db["service"].find_one({"code": code})
+        if service is not None:
+            _service_cache[code] = service
+    return service
+
+SERVICE_LIST_FIELDS = ["code", "name", "price", "active"]
+
 @app.get("/services", response_model=List[dict])
-def list_services():
-    items = get_documents("service")
-    return [to_str_id(x) for x in items]
+async def list_services(fields: Optional[str] = None):
+    return await stream_documents("service", projection=build_projection(ServiceSchema, SERVICE_LIST_FIELDS, fields))
 
 class CreateService(BaseModel):
     code: str
@@ -94,14 +208,15 @@ class CreateService(BaseModel):
     price: float
 
 @app.post("/services", response_model=dict)
-def create_service(payload: CreateService):
-    # enforce unique code
-    if db["service"].find_one({"code": payload.code}):
-        raise HTTPException(status_code=400, detail="Service code already exists")
+async def create_service(payload: CreateService):
     service = ServiceSchema(code=payload.code, name=payload.name, description=payload.description, price=payload.price)
-    new_id = create_document("service", service)
-    created = db["service"].find_one({"_id": ObjectId(new_id)})
-    return to_str_id(created)
+    # unique code is enforced by the index
+    try:
+        _, created = await create_document("service", service)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Service code already exists")
+    _service_cache.pop(payload.code, None)
+    return document_response(created)
 
 # Payment endpoints (simple demo, marks as paid)
 class CreatePayment(BaseModel):
@@ -109,36 +224,35 @@ class CreatePayment(BaseModel):
     service_code: str
 
 @app.post("/payments", response_model=dict)
-def create_payment(payload: CreatePayment):
-    user = db["user"].find_one({"email": payload.user_email})
+async def create_payment(payload: CreatePayment):
+    user, service = await asyncio.gather(
+        get_user_by_email(payload.user_email),
+        get_service_by_code(payload.service_code),
+    )
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    service = db["service"].find_one({"code": payload.service_code})
     if not service:
         raise HTTPException(status_code=404, detail="Service not found")
+    user_id = str(user["_id"])
     amount = float(service["price"])
     payment = PaymentSchema(
-        user_id=str(user["_id"]),
+        user_id=user_id,
         service_code=service["code"],
         amount=amount,
         status="paid",
-        reference=sha256(f"{user['_id']}:{service['code']}:{datetime.utcnow().isoformat()}".encode()).hexdigest()[:12]
+        reference=secrets.token_hex(6)
     )
-    pay_id = create_document("payment", payment)
-    created = db["payment"].find_one({"_id": ObjectId(pay_id)})
-    return to_str_id(created)
+    _, created = await create_document("payment", payment)
+    return document_response(created)
 
 # Results endpoints
+RESULT_LIST_FIELDS = ["user_id", "service_code", "reported_at"]
+
 @app.get("/results", response_model=List[dict])
-def list_results(user_email: Optional[str] = None):
-    filt = {}
-    if user_email:
-        u = db["user"].find_one({"email": user_email})
-        if not u:
-            return []
-        filt = {"user_id": str(u["_id"]) }
-    items = get_documents("result", filt)
-    return [to_str_id(x) for x in items]
+async def list_results(user_email: Optional[str] = None, fields: Optional[str] = None):
+    # user_email is stored on each result, so filtering needs no user lookup
+    filt = {"user_email": user_email} if user_email else {}
+    return await stream_documents("result", filt, build_projection(ResultSchema, RESULT_LIST_FIELDS, fields))
 
 class CreateResult(BaseModel):
     user_email: EmailStr
@@ -147,24 +261,86 @@ class CreateResult(BaseModel):
     notes: Optional[str] = None
 
 @app.post("/results", response_model=dict)
-def create_result(payload: CreateResult):
-    user = db["user"].find_one({"email": payload.user_email})
+async def create_result(payload: CreateResult):
+    user, service = await asyncio.gather(
+        get_user_by_email(payload.user_email),
+        get_service_by_code(payload.service_code),
+    )
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if not db["service"].find_one({"code": payload.service_code}):
+    if not service:
         raise HTTPException(status_code=404, detail="Service not found")
     result = ResultSchema(
         user_id=str(user["_id"]),
+        user_email=user["email"],
         service_code=payload.service_code,
         values=payload.values,
         notes=payload.notes
     )
-    res_id = create_document("result", result)
-    created = db["result"].find_one({"_id": ObjectId(res_id)})
-    return to_str_id(created)
+    _, created = await create_document("result", result)
+    return document_response(created)
+
+MAX_BULK_RESULTS = 500
+
+class BulkResultError(BaseModel):
+    index: int
+    message: str
+
+class BulkResultsPartial(BaseModel):
+    inserted: List[dict]
+    errors: List[BulkResultError]
+
+@app.post(
+    "/results/bulk",
+    response_model=List[dict],
+    responses={207: {"model": BulkResultsPartial, "description": "Some rows failed to insert; the rest were stored"}},
+)
+async def create_results_bulk(payload: Annotated[List[CreateResult], Body(max_length=MAX_BULK_RESULTS)]):
+    if not payload:
+        return []
+    emails = {r.user_email for r in payload}
+    codes = list({r.service_code for r in payload})
+    # One query for all users, cached lookups for the services, all in flight together
+    users_cursor = db["user"].find({"email": {"$in": list(emails)}}, {"_id": 1, "email": 1})
+    users, *services = await asyncio.gather(
+        users_cursor.to_list(length=None),
+        *(get_service_by_code(code) for code in codes),
+    )
+    users_by_email = {u["email"]: u for u in users}
+    missing_users = emails - users_by_email.keys()
+    if missing_users:
+        raise HTTPException(status_code=404, detail=f"User not found: {', '.join(sorted(missing_users))}")
+    missing_services = {code for code, service in zip(codes, services) if not service}
+    if missing_services:
+        raise HTTPException(status_code=404, detail=f"Service not found: {', '.join(sorted(missing_services))}")
+    results = [
+        ResultSchema(
+            user_id=str(users_by_email[r.user_email]["_id"]),
+            user_email=r.user_email,
+            service_code=r.service_code,
+            values=r.values,
+            notes=r.notes
+        )
+        for r in payload
+    ]
+    created, errors = await create_documents("result", results)
+    if errors:
+        # Unordered insert: the other rows were written, so report both sides
+        return ORJSONResponse(
+            status_code=207,
+            content={"inserted": [to_str_id(doc) for doc in created], "errors": errors},
+        )
+    return ORJSONResponse([to_str_id(doc) for doc in created])
+
+# Environment is fixed for the life of the process
+_HAS_DB_URL = bool(os.getenv("DATABASE_URL"))
+_HAS_DB_NAME = bool(os.getenv("DATABASE_NAME"))
+
+# Health probes hit /test often; don't run listCollections on every call
+_collections_cache = TTLCache(maxsize=1, ttl=10)
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -180,7 +356,10 @@ def test_database():
             response["database_name"] = db.name
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = _collections_cache.get("names")
+                if collections is None:
+                    collections = await db.list_collection_names()
+                    _collections_cache["names"] = collections
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -190,12 +369,15 @@ def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    import os as _os
-    response["database_url"] = "✅ Set" if _os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if _os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = "✅ Set" if _HAS_DB_URL else "❌ Not Set"
+    response["database_name"] = "✅ Set" if _HAS_DB_NAME else "❌ Not Set"
     return response
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Same policy as the Procfile: async workers each serve many requests, so default
+    # to a small fixed count and scale out explicitly with WEB_CONCURRENCY
+    workers = int(os.getenv("WEB_CONCURRENCY", 2))
+    # loop/http stay on "auto": uvloop and httptools are used whenever they're installed
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers)
@@ -47,6 +47,7 @@ class Result(BaseModel):
     Collection: "result"
     """
     user_id: str = Field(..., description="User identifier (as string)")
+    user_email: EmailStr = Field(..., description="Owner's email, denormalized for filtering")
     service_code: str = Field(..., description="Related service/test code")
     values: dict = Field(default_factory=dict, description="Result values as key-value pairs")
     notes: Optional[str] = Field(None, description="Additional notes")